@@ -1,12 +1,39 @@
+import functools
 import time
 import requests
+from http.cookiejar import DefaultCookiePolicy
 from typing import Optional, Dict, Tuple, Any
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .config import settings
 from .logger import setup_logging
 
 logger = setup_logging(__name__)
 
+# Shared HTTP session: API calls reuse pooled keep-alive connections instead of
+# paying a TCP+TLS handshake per request. The session's own cookie jar is
+# disabled so requests stay stateless; cookies are always passed explicitly.
+# The pool holds one connection per upload worker so concurrent uploads never
+# have to open (and then discard) extra connections. Retry's default
+# allowed_methods leaves POST out, so an upload is only retried when the
+# connection failed before anything was sent. HTTP/2 would only let the
+# same few uploads share one socket; with a handful of workers, one pooled
+# HTTP/1.1 connection each gives the same concurrency.
+http_session = requests.Session()
+http_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+http_session.headers["User-Agent"] = settings.USER_AGENT
+http_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=max(8, settings.UPLOAD_WORKERS),
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]
+        ),
+    ),
+)
+
 
 class SessionData(BaseModel):
     token: str
@@ -25,20 +52,22 @@ def save_session(
     try:
         with open(settings.SESSION_FILE, "w") as f:
             f.write(session.model_dump_json(indent=4))
-        logger.info(f"Session saved to {settings.SESSION_FILE}")
+        get_session.cache_clear()
+        logger.info("Session saved to %s", settings.SESSION_FILE)
     except IOError as e:
-        logger.error(f"Failed to save session: {e}")
+        logger.error("Failed to save session: %s", e)
         raise
 
 
+@functools.lru_cache(maxsize=1)
 def get_session() -> Optional[SessionData]:
-    """Load session data from the local file."""
+    """Load session data from the local file (cached until the next save)."""
     if settings.SESSION_FILE.exists():
         try:
             with open(settings.SESSION_FILE, "r") as f:
                 return SessionData.model_validate_json(f.read())
         except Exception as e:
-            logger.warning(f"Failed to load session, file may be corrupted: {e}")
+            logger.warning("Failed to load session, file may be corrupted: %s", e)
             return None
     return None
 
@@ -62,19 +91,16 @@ def set_client() -> str:
         "timeStamp": str(int(time.time() * 1000)),
         "channelId": settings.CHANNEL_ID
     }
-    headers = {
-        "User-Agent": settings.USER_AGENT
-    }
     
     logger.debug("Setting client to retrieve ton...")
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = http_session.get(url, params=params, timeout=10)
         response.raise_for_status()
         
         data = response.json()
         if data.get("status") != "ok":
             error_msg = data.get('msg', 'Unknown error')
-            logger.error(f"setClient failed: {error_msg}")
+            logger.error("setClient failed: %s", error_msg)
             raise Exception(f"setClient failed: {error_msg}")
             
         ton = data.get("token", {}).get("token")
@@ -85,7 +111,7 @@ def set_client() -> str:
         return ton
 
     except requests.RequestException as e:
-        logger.error(f"Network error during setClient: {e}")
+        logger.error("Network error during setClient: %s", e)
         raise
 
 def authenticate(user_id: str, password: str, token:Optional[str]=None) -> Tuple[Dict[str, str], str, str]:
@@ -113,27 +139,24 @@ def authenticate(user_id: str, password: str, token:Optional[str]=None) -> Tuple
         "password": password,
         "timeStamp": str(int(time.time() * 1000))
     }
-    headers = {
-        "User-Agent": settings.USER_AGENT
-    }
 
-    logger.debug(f"Authenticating user: {user_id}")
+    logger.debug("Authenticating user: %s", user_id)
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
+        response = http_session.get(url, params=params, timeout=10)
         response.raise_for_status()
 
         data = response.json()
         if data.get("status") != "ok":
             error_msg = data.get("msg", "Unknown error")
-            logger.error(f"Login failed: {error_msg}")
+            logger.error("Login failed: %s", error_msg)
             raise Exception(f"Login failed: {error_msg}")
 
         account_id = str(data.get("user", {}).get("accountId", ""))
-        logger.info(f"Authentication successful for accountId: {account_id}")
+        logger.info("Authentication successful for accountId: %s", account_id)
         return response.cookies.get_dict(), account_id, token
 
     except requests.RequestException as e:
-        logger.error(f"Network error during authentication: {e}")
+        logger.error("Network error during authentication: %s", e)
         raise
 
 
@@ -151,17 +174,14 @@ def get_user_info(token: str, friend_id: str, cookies: Dict[str, str]) -> Dict[s
     """
     url = f"{settings.BASE_URL}/bk_getUserInfo"
     params = {"ton": token, "friendId": friend_id}
-    headers = {
-        "User-Agent": settings.USER_AGENT
-    }
 
-    logger.debug(f"Getting info for friendId: {friend_id}")
+    logger.debug("Getting info for friendId: %s", friend_id)
     try:
-        response = requests.get(
-            url, params=params, headers=headers, cookies=cookies, timeout=10
+        response = http_session.get(
+            url, params=params, cookies=cookies, timeout=10
         )
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
-        logger.error(f"Failed to get user info: {e}")
+        logger.error("Failed to get user info: %s", e)
         raise
@@ -1,8 +1,12 @@
 
 import asyncio
 import binascii
+import functools
+import logging
 import os
-from typing import List, Type, ClassVar, Tuple, Dict, Any, TypeVar
+import struct
+from collections import deque
+from typing import AsyncIterator, List, Type, ClassVar, Tuple, Dict, Any, TypeVar
 from enum import Enum
 from datetime import datetime, timedelta
 from bleak import BleakClient
@@ -69,8 +73,45 @@ class Oid(Enum):
 T = TypeVar("T", bound="Message")
 
 
+def wire_key(cmd_type: int, trans_type: int, oid: int) -> int:
+    """Flat registry key for the raw cmd type, trans type and oid values."""
+    return cmd_type << 18 | trans_type << 16 | oid
+
+
+# Frame layout: header byte, 16-bit big-endian length, [16-bit oid, payload],
+# 16-bit CRC. Precompiled so the hot path avoids repeated int.from_bytes calls.
+FRAME_HEADER = struct.Struct(">BH")
+FRAME_U16 = struct.Struct(">H")
+RECEIVE_FILE_HEADER = struct.Struct(">BB")
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Decode a protobuf varint at pos, returning (value, next_pos)."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Escape code (1..3) -> original byte, see Message.escape
+UNESCAPED_BYTES = (b"", b"\x7d", b"\x7e", b"\x7f")
+
+# The same mapping as escaped pairs. Undoing 7d01 yields a new 0x7d, so it has
+# to come last when the pairs are replaced in order.
+ESCAPE_PAIRS = (
+    (b"\x7d\x03", b"\x7f"),
+    (b"\x7d\x02", b"\x7e"),
+    (b"\x7d\x01", b"\x7d"),
+)
+
+
 class Message(BaseModel):
     _REGISTRY: ClassVar[Dict[Tuple[CmdType, TransType, Oid], Type["Message"]]] = {}
+    # Same classes keyed by wire_key() of the raw header values
+    _WIRE_REGISTRY: ClassVar[Dict[int, Type["Message"]]] = {}
 
     _trans_type: ClassVar[TransType] = TransType.Default
     _cmd_type: ClassVar[CmdType] = CmdType.Get
@@ -95,71 +136,74 @@ class Message(BaseModel):
     # The packet uses 0x7e as start, 0x7f as end, so we need to escape those bytes
     # in the payload. The escape character is 0x7d.
     def escape(data: bytes):
-        buf = bytearray()
-        for b in data:
-            if b in (0x7D, 0x7E, 0x7F):
-                buf.append(0x7D)
-                buf.append(b - 0x7D + 1)
-            else:
-                buf.append(b)
-        return bytes(buf)
+        # Most packets contain no reserved bytes; `in` is a memchr scan.
+        if b"\x7d" not in data and b"\x7e" not in data and b"\x7f" not in data:
+            return data
+        # Each reserved byte b becomes 0x7d, (b - 0x7d + 1). bytes.replace runs
+        # in C; 0x7d goes first so the inserted escape bytes are left alone.
+        return (
+            data.replace(b"\x7d", b"\x7d\x01")
+            .replace(b"\x7e", b"\x7d\x02")
+            .replace(b"\x7f", b"\x7d\x03")
+        )
 
     @staticmethod
     def unescape(data: bytes):
-        buf = bytearray()
-        i = 0
-        while i < len(data):
-            b = data[i]
-            if b == 0x7D:
-                i += 1
-                assert i < len(data), (
-                    f"Invalid escape sequence at end of packet: {data.hex()}"
-                )
-                assert data[i] > 0, (
-                    f"Invalid escape sequence value: {data[i]:02x} at {i}"
-                )
-                assert data[i] < 4, (
-                    f"Invalid escape sequence value: {data[i]:02x} at {i}"
-                )
-                buf.append(data[i] + 0x7D - 1)
-            else:
-                buf.append(b)
-            i += 1
-        return bytes(buf)
+        escapes = data.count(b"\x7d")
+        if not escapes:
+            return data
+
+        if escapes * 8 > len(data):
+            # Dense frame: undo whole pairs with replaces instead of touching
+            # each escape in Python. An escape code is never 0x7d, so pairs
+            # cannot overlap and the frame is valid exactly when every 0x7d
+            # starts one of them; if not, fall through to report the error.
+            if escapes == sum(data.count(pair) for pair, _ in ESCAPE_PAIRS):
+                for pair, byte in ESCAPE_PAIRS:
+                    data = data.replace(pair, byte)
+                return data
+
+        # Every chunk after a 0x7d starts with the escape code for one byte;
+        # split/join keeps the scanning and copying in C.
+        parts = data.split(b"\x7d")
+        last = len(parts) - 1
+        buf = [parts[0]]
+        for i in range(1, len(parts)):
+            part = parts[i]
+            assert part or i < last, (
+                f"Invalid escape sequence at end of packet: {data.hex()}"
+            )
+            code = part[0] if part else 0x7D
+            assert 0 < code < 4, f"Invalid escape sequence value: {code:02x}"
+            buf.append(UNESCAPED_BYTES[code])
+            buf.append(part[1:])
+        return b"".join(buf)
 
     @classmethod
     def from_bytes(cls: Type[T], data: bytes):
-        assert data[0] == 0x7E, f"Invalid start byte: {data[0]:02x}"
-        assert data[-1] == 0x7F, f"Invalid end byte: {data[-1]:02x}"
-
-        data = cls.unescape(data[1:-1])
-
-        crc = int.from_bytes(data[-2:], "big")
-        crc_calc = binascii.crc_hqx(data[:-2], 0xFFFF)
-        assert crc == crc_calc, f"crc mismatch: {crc=:04x} != {crc_calc=:04x}"
-
-        assert len(data) >= 5, f"Invalid packet length: {len(data)}"
-        length = int.from_bytes(data[1:3], "big")
-        assert length == len(data), f"Invalid packet length: {length}"
-
-        cmd_type = CmdType(data[0] >> 6)
-        trans_type = TransType((data[0] >> 4) & 0x03)
-
-        sid = data[0] & 0x0F
-
-        if trans_type == TransType.Ack:
-            assert len(data) == 5, f"Invalid packet length: {len(data)}"
-            oid = Oid.Invalid
-            payload = b""
-        else:
-            assert len(data) >= 7, f"Invalid packet length: {len(data)}"
-            oid = Oid(int.from_bytes(data[3:5], "big"))
-            payload = data[5:-2]
-
-        cls_key = (cmd_type, trans_type, oid)
-        target_class = cls._REGISTRY.get(cls_key)
+        header, oid_value, payload = decode_frame(data)
+        sid = header & 0x0F
+
+        # Look the class up by its raw header bits; no Enum construction needed
+        cmd_value = header >> 6
+        trans_value = (header >> 4) & 0x03
+        target_class = cls._WIRE_REGISTRY.get(
+            wire_key(cmd_value, trans_value, oid_value)
+        )
         if not target_class:
-            raise ValueError(f"Unknown Packet type: {cls_key}")
+            raise ValueError(
+                f"Unknown Packet type: cmd={cmd_value}, "
+                f"trans={trans_value}, oid={oid_value:#06x}"
+            )
+        if target_class is ReceiveFile:
+            # Data fragments dominate RX traffic and their fields already have
+            # the right types, so skip pydantic validation for them.
+            return ReceiveFile.model_construct(
+                sid=sid,
+                seq=payload[0],
+                flag=_receive_file_flag(payload[1]),
+                data=payload[2:],
+            )
         kwargs = target_class.parse_payload(payload)
         return target_class(sid=sid, **kwargs)
 
@@ -181,6 +225,7 @@ class Message(BaseModel):
             f"Duplicate key: {key}, {cls._REGISTRY[key]} vs {cls}"
         )
         cls._REGISTRY[key] = cls
+        cls._WIRE_REGISTRY[wire_key(cmd_type.value, trans_type.value, oid.value)] = cls
 
     @classmethod
     def parse_payload(cls: Type[T], payload: bytes) -> Dict[str, Any]:
@@ -190,29 +235,18 @@ class Message(BaseModel):
         return b""
 
     def to_bytes(self, sid_override: int = 0) -> bytes:
-        buf = bytearray()
-
         if sid_override == 0:
             sid_override = self.sid
 
-        buf.append(
+        header = (
             self.cmd_type.value << 6
             | self.trans_type.value << 4
             | (sid_override & 0x0F)
         )
         if self.trans_type == TransType.Ack:
-            payload = b""
-        else:
-            payload = self.oid.value.to_bytes(2, "big") + self.export_payload()
-
-        length = len(payload) + 5
-        buf.extend(length.to_bytes(2, "big"))
-        buf.extend(payload)
-
-        crc = binascii.crc_hqx(buf, 0xFFFF)
-        buf.extend(crc.to_bytes(2, "big"))
-
-        return b"\x7e" + self.escape(buf) + b"\x7f"
+            return encode_frame(header, b"")
+        payload = FRAME_U16.pack(self.oid.value) + self.export_payload()
+        return encode_frame(header, payload)
 
     def ack(self) -> "Message":
         cmd_type = self.cmd_type
@@ -224,57 +258,144 @@ class Message(BaseModel):
         return self.__repr__()
 
 
-class GetAck(Message, trans_type=TransType.Ack, cmd_type=CmdType.Push):
+def decode_frame(data: bytes) -> Tuple[int, int, bytes]:
+    """
+    Deframe, unescape and CRC-check one 0x7e..0x7f frame.
+
+    Returns (header byte, oid, payload); acks have no oid and report
+    Oid.Invalid with an empty payload.
+    """
+    assert data[0] == 0x7E, f"Invalid start byte: {data[0]:02x}"
+    assert data[-1] == 0x7F, f"Invalid end byte: {data[-1]:02x}"
+
+    data = Message.unescape(data[1:-1])
+
+    # CRC-16/CCITT has a zero residue: running it over the payload plus
+    # its big-endian CRC yields 0, so one pass checks the frame without
+    # slicing. The two values are only worked out for the error message.
+    if binascii.crc_hqx(data, 0xFFFF) != 0:
+        crc = int.from_bytes(data[-2:], "big")
+        crc_calc = binascii.crc_hqx(data[:-2], 0xFFFF)
+        assert crc == crc_calc, f"crc mismatch: {crc=:04x} != {crc_calc=:04x}"
+
+    assert len(data) >= 5, f"Invalid packet length: {len(data)}"
+    header, length = FRAME_HEADER.unpack_from(data)
+    assert length == len(data), f"Invalid packet length: {length}"
+
+    if (header >> 4) & 0x03 == TransType.Ack.value:
+        assert len(data) == 5, f"Invalid packet length: {len(data)}"
+        return header, Oid.Invalid.value, b""
+
+    assert len(data) >= 7, f"Invalid packet length: {len(data)}"
+    (oid_value,) = FRAME_U16.unpack_from(data, 3)
+    return header, oid_value, data[5:-2]
+
+
+def encode_frame(header: int, payload: bytes) -> bytes:
+    """Add length and CRC around header + payload, then escape and delimit."""
+    buf = bytearray(FRAME_HEADER.pack(header, len(payload) + 5))
+    buf += payload
+    buf += FRAME_U16.pack(binascii.crc_hqx(buf, 0xFFFF))
+    return b"\x7e" + Message.escape(buf) + b"\x7f"
+
+
+class PrebuiltFrames:
+    """
+    Messages without a payload only vary by sid, so every frame they can
+    produce is built once by @prebuilt_frames and looked up afterwards.
+    """
+
+    FRAMES: ClassVar[Tuple[bytes, ...]] = ()
+
+    def to_bytes(self, sid_override: int = 0) -> bytes:
+        return self.FRAMES[(sid_override or self.sid) & 0x0F]
+
+
+def prebuilt_frames(cls: Type[T]) -> Type[T]:
+    cls.FRAMES = tuple(Message.to_bytes(cls(sid=sid)) for sid in range(16))
+    return cls
+
+
+@prebuilt_frames
+class GetAck(
+    PrebuiltFrames, Message, trans_type=TransType.Ack, cmd_type=CmdType.Push
+):
     pass
 
 
-class PushAck(Message, trans_type=TransType.Ack, cmd_type=CmdType.Get):
+@prebuilt_frames
+class PushAck(
+    PrebuiltFrames, Message, trans_type=TransType.Ack, cmd_type=CmdType.Get
+):
     pass
 
 
+# Message cmd_type -> prebuilt ack frames indexed by sid
+ACK_FRAMES = {ack.cmd_type: ack.FRAMES for ack in (GetAck, PushAck)}
+
+
 class PacketStream:
     def __init__(self, client: BleakClient, char_uuid: str):
         self.client = client
         self.char_uuid = char_uuid
+        # Write mode for acks; None leaves the choice to bleak
+        self.ack_response: bool | None = None
         self.seq = 0
-        self.rx_buf = b""
+        self.rx_buf = bytearray()
         self.rx_sem = asyncio.Semaphore(0)
-        self.rx_messages: List[Message] = []
+        self.rx_messages: deque[Message] = deque()
 
     def on_notify(self, _: str, data: bytes):
-        logger.debug(f"RX({self.char_uuid}): {data.hex()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("RX(%s): %s", self.char_uuid, data.hex())
 
-        self.rx_buf += data
+        # Only the newly arrived bytes can hold the end marker of a pending
+        # frame, and 0x7f never appears escaped, so it always ends a frame.
+        start = len(self.rx_buf)
+        self.rx_buf.extend(data)
         assert self.rx_buf[0] == 0x7E
-        if self.rx_buf[-1] == 0x7F:
-            message = Message.from_bytes(self.rx_buf)
+        while (end := self.rx_buf.find(0x7F, start)) >= 0:
+            frame = bytes(self.rx_buf[: end + 1])
+            del self.rx_buf[: end + 1]
+            message = Message.from_bytes(frame)
             self.rx_messages.append(message)
             self.rx_sem.release()
-            self.rx_buf = b""
+            start = 0
 
     def clear(self):
-        self.rx_buf = b""
+        self.rx_buf.clear()
         self.rx_messages.clear()
         self.rx_sem = asyncio.Semaphore(0)
 
     @classmethod
     async def create(cls, client: BleakClient, char_uuid: str):
         stream = cls(client, char_uuid)
+        char = client.services.get_characteristic(char_uuid)
+        if char is not None and "write-without-response" in char.properties:
+            stream.ack_response = False
         await client.start_notify(char_uuid, stream.on_notify)
         await asyncio.sleep(1)
         return stream
 
-    async def write(self, message: Message):
-        data = message.to_bytes(sid_override=self.seq)
-        logger.debug(f"TX({self.char_uuid}): {data.hex()}")
-        await self.client.write_gatt_char(self.char_uuid, data)
+    async def write(self, message: Message, response: bool | None = None):
+        await self.write_bytes(message.to_bytes(sid_override=self.seq), response)
+
+    async def write_bytes(self, data: bytes, response: bool | None = None):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("TX(%s): %s", self.char_uuid, data.hex())
+        await self.client.write_gatt_char(self.char_uuid, data, response=response)
 
     async def read(self, timeout: int = 60) -> Message:
         try:
             await asyncio.wait_for(self.rx_sem.acquire(), timeout)
-            message = self.rx_messages.pop(0)
+            message = self.rx_messages.popleft()
             assert message.sid == self.seq, f"Invalid sid: {message.sid} != {self.seq}"
-            await self.write(message.ack())
+            # Acks are small and idempotent; skip the ATT write response when
+            # the characteristic allows it, so they don't cost a full
+            # connection interval per fragment.
+            await self.write_bytes(
+                ACK_FRAMES[message.cmd_type][self.seq], self.ack_response
+            )
             self.seq = (self.seq + 1) & 0x0F
             return message
         except asyncio.TimeoutError:
@@ -284,7 +405,8 @@ class PacketStream:
         await self.client.stop_notify(self.char_uuid)
 
 
-class GetDeviceInfoRequest(Message, oid=Oid.GetDeviceInfo):
+@prebuilt_frames
+class GetDeviceInfoRequest(PrebuiltFrames, Message, oid=Oid.GetDeviceInfo):
     pass
 
 
@@ -358,7 +480,13 @@ class GetFile(Message, oid=Oid.GetFile):
         return {"filename": params.filename}
 
     def export_payload(self) -> bytes:
-        return self._ProtoDef(filename=self.filename).dumps()
+        return encode_get_file(self.filename)
+
+
+@functools.lru_cache(maxsize=32)
+def encode_get_file(filename: str) -> bytes:
+    """The same few filenames are requested on every sync."""
+    return GetFile._ProtoDef(filename=filename).dumps()
 
 
 class GetFileResponse(Message, oid=Oid.GetFile, trans_type=TransType.Response):
@@ -376,7 +504,8 @@ class GetFileResponse(Message, oid=Oid.GetFile, trans_type=TransType.Response):
         return self._ProtoDef(exist=self.exist).dumps()
 
 
-class GetFileStatus(Message, oid=Oid.GetFileStatus):
+@prebuilt_frames
+class GetFileStatus(PrebuiltFrames, Message, oid=Oid.GetFileStatus):
     pass
 
 
@@ -396,8 +525,29 @@ class FileInfo(Message, oid=Oid.PostFileInfo, cmd_type=CmdType.Push):
 
     @classmethod
     def parse_payload(cls, payload: bytes):
-        params = cls._ProtoDef.loads(payload)
-        return {"filename": params.filename, "size": params.size}
+        # Hand-rolled decode of the two fields; missing ones are left for
+        # pydantic to report. Unknown fields are skipped.
+        params = {}
+        pos = 0
+        while pos < len(payload):
+            tag, pos = read_varint(payload, pos)
+            wire_type = tag & 0x07
+            if wire_type == 0:
+                value, pos = read_varint(payload, pos)
+                if tag >> 3 == 2:
+                    params["size"] = (value >> 1) ^ -(value & 1)
+            elif wire_type == 2:
+                length, pos = read_varint(payload, pos)
+                if tag >> 3 == 1:
+                    params["filename"] = payload[pos : pos + length].decode()
+                pos += length
+            elif wire_type == 1:
+                pos += 8
+            elif wire_type == 5:
+                pos += 4
+            else:
+                raise ValueError(f"Unsupported wire type: {wire_type}")
+        return params
 
     def export_payload(self) -> bytes:
         return self._ProtoDef(filename=self.filename, size=self.size).dumps()
@@ -410,6 +560,17 @@ class ReceiveFileFlag(Enum):
     Single = 0x03
 
 
+_FLAG_BY_VAL = {flag.value: flag for flag in ReceiveFileFlag}
+
+
+def _receive_file_flag(value: int) -> ReceiveFileFlag:
+    # A dict hit is cheaper than ReceiveFileFlag(value) but must keep its error
+    flag = _FLAG_BY_VAL.get(value)
+    if flag is None:
+        raise ValueError(f"Invalid ReceiveFile flag: {value:#04x}")
+    return flag
+
+
 class ReceiveFile(Message, oid=Oid.ReceiveFile, cmd_type=CmdType.Push):
     seq: int
     flag: ReceiveFileFlag
@@ -419,14 +580,12 @@ class ReceiveFile(Message, oid=Oid.ReceiveFile, cmd_type=CmdType.Push):
     def parse_payload(cls, payload: bytes):
         return {
             "seq": payload[0],
-            "flag": ReceiveFileFlag(payload[1]),
+            "flag": _receive_file_flag(payload[1]),
             "data": payload[2:],
         }
 
     def export_payload(self) -> bytes:
-        return (
-            self.seq.to_bytes(1, "big") + self.flag.value.to_bytes(1, "big") + self.data
-        )
+        return RECEIVE_FILE_HEADER.pack(self.seq, self.flag.value) + self.data
 
 class BB16:
     def __init__(self, address: str):
@@ -455,7 +614,8 @@ class BB16:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.disconnect()
 
-    async def download_file(self, filename: str, save_dir: str | None = None) -> bytes:
+    async def _request_file(self, filename: str) -> FileInfo | None:
+        """Ask the device for a file; returns its FileInfo, or None if it does not exist."""
         logger.info(f"Downloading {filename}...")
         await self.get_stream.write(GetFile(filename=filename))
 
@@ -467,29 +627,71 @@ class BB16:
 
         fileInfo: FileInfo = await self.push_stream.read()
         logger.debug(f"get_file post data: {fileInfo}")
+        return fileInfo
 
-        fileData = bytearray()
+    async def _iter_fragments(self, filename: str, size: int) -> AsyncIterator[bytes]:
+        """Yield the data of each fragment of the file being transferred."""
+        received = 0
         while True:
             frag: ReceiveFile = await self.push_stream.read()
-            fileData.extend(frag.data)
-            logger.debug(f"Downloaded {filename}... {len(fileData)} / {fileInfo.size}")
+            yield frag.data
+            received += len(frag.data)
+            logger.debug("Downloaded %s... %d / %d", filename, received, size)
             if frag.flag in (ReceiveFileFlag.Last, ReceiveFileFlag.Single):
                 break
 
-        if save_dir:
-            local_name = os.path.join(save_dir, filename)
-            logger.info(f"Saving {filename} to {local_name}...")
-            with open(local_name, "wb") as f:
-                f.write(fileData)
+    async def download_file(self, filename: str) -> bytes | None:
+        """Download a file from the device and return its content."""
+        fileInfo = await self._request_file(filename)
+        if fileInfo is None:
+            return None
 
+        fileData = bytearray()
+        async for data in self._iter_fragments(filename, fileInfo.size):
+            fileData.extend(data)
         return bytes(fileData)
 
+    async def save_file(self, filename: str, save_dir: str) -> str | None:
+        """
+        Download a file from the device into save_dir, streaming fragments to
+        disk as they arrive. Returns the saved path, or None if the file does
+        not exist on the device.
+        """
+        fileInfo = await self._request_file(filename)
+        if fileInfo is None:
+            return None
+
+        # Write into a temp file so an interrupted transfer never leaves a
+        # truncated record next to the complete ones.
+        local_name = os.path.join(save_dir, filename)
+        part_name = local_name + ".part"
+        logger.info(f"Saving {filename} to {local_name}...")
+        f = await asyncio.to_thread(open, part_name, "wb")
+        try:
+            try:
+                async for data in self._iter_fragments(filename, fileInfo.size):
+                    # Incoming notifications keep queueing while the write runs
+                    await asyncio.to_thread(f.write, data)
+            finally:
+                await asyncio.to_thread(f.close)
+        except BaseException:
+            await asyncio.to_thread(os.remove, part_name)
+            raise
+
+        await asyncio.to_thread(os.replace, part_name, local_name)
+        return local_name
+
     async def download_files(self, save_dir: str, *filenames: str):
         for filename in filenames:
-            await self.download_file(filename, save_dir=save_dir)
+            await self.save_file(filename, save_dir)
 
     async def download_records(self, save_dir: str, last_n_days: int = 365) -> List[str]:
-        data = await self.download_file("filelist.txt", save_dir=save_dir)
+        list_path = await self.save_file("filelist.txt", save_dir)
+        if not list_path:
+            # Never fall back to a filelist.txt left over from an earlier sync
+            return []
+        with open(list_path, "rb") as f:
+            data = f.read()
         filenames = []
         since = datetime.now() - timedelta(days=last_n_days)
         for line in data.decode().strip().split("\n"):
@@ -506,14 +708,19 @@ class BB16:
                 logger.info(f"File {name} is older than {last_n_days} days, skipping...")
                 continue
 
-            local_name = os.path.join(save_dir, name)
-            if os.path.exists(local_name) and os.path.getsize(local_name) == size:
+            # One stat answers both "exists" and "same size"
+            try:
+                local_size = os.stat(os.path.join(save_dir, name)).st_size
+            except FileNotFoundError:
+                local_size = None
+            if local_size == size:
                 logger.warning(f"File {name}({size} bytes) already exists, skipping...")
                 continue
 
-            await self.download_file(name, save_dir=save_dir)
             filenames.append(name)
 
+        # Decide everything locally first so the transfers run back to back
+        await self.download_files(save_dir, *filenames)
         return filenames
 
     async def sync(self, data_dir: str = "data", last_n_days: int = 365) -> List[str]:
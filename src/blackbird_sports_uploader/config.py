@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -10,6 +10,7 @@ class Settings(BaseSettings):
     # Filenames (relative to DATA_DIR)
     SESSION_FILENAME: str = ".session.json"
     UPLOAD_HISTORY_FILENAME: str = "uploaded_records.json"
+    UPLOAD_JOURNAL_FILENAME: str = "uploaded_records.ndjson"
 
     @property
     def SESSION_FILE(self) -> Path:
@@ -21,6 +22,11 @@ class Settings(BaseSettings):
         """Return the full path to the upload history file."""
         return self.DATA_DIR / self.UPLOAD_HISTORY_FILENAME
 
+    @property
+    def UPLOAD_JOURNAL_FILE(self) -> Path:
+        """Return the full path to the append-only upload journal."""
+        return self.DATA_DIR / self.UPLOAD_JOURNAL_FILENAME
+
     # Device
     BLE_ADDRESS: Optional[str] = None  # MAC address of the device
 
@@ -31,6 +37,11 @@ class Settings(BaseSettings):
     # Sync Configuration
     SYNC_INTERVAL: int = 300  # Seconds to wait between syncs in loop mode (default 5 mins)
     SYNC_ONLY_N_DAYS: int = 365
+    UPLOAD_WORKERS: int = 4  # Concurrent record uploads
+    ZIP_COMPRESS_LEVEL: int = 6  # zlib level for record archives (1 fastest, 9 smallest)
+    # Record payload: "zip" (multipart archive, what the app sends) or, for
+    # servers known to accept them, "gzip" / "raw" XML request bodies
+    UPLOAD_FORMAT: Literal["zip", "gzip", "raw"] = "zip"
 
     # API Configuration
     BASE_URL: str = "https://client.blackbirdsport.com"
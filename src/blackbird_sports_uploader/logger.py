@@ -1,3 +1,4 @@
+import functools
 import logging
 import sys
 from .config import settings
@@ -5,33 +6,35 @@ from .config import settings
 
 from logging.handlers import RotatingFileHandler
 
+# Settings are read once; every module's logger shares these
+CONSOLE_LEVEL = settings.LOG_LEVEL_CONSOLE.upper()
+FILE_LEVEL = settings.LOG_LEVEL_FILE.upper()
+
+# Set loggers to the lowest level to capture all messages
+MIN_LEVEL = min(
+    getattr(logging, CONSOLE_LEVEL, logging.INFO),
+    getattr(logging, FILE_LEVEL, logging.DEBUG)
+)
+
+# Use a standard format
+FORMATTER = logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+@functools.lru_cache(maxsize=None)
 def setup_logging(name: str) -> logging.Logger:
     """
     Setup logging configuration for the application.
     Configures console and rotating file handlers based on settings.
     """
     logger = logging.getLogger(name)
-    
-    # Set logger to the lowest level to capture all messages
-    console_level = settings.LOG_LEVEL_CONSOLE.upper()
-    file_level = settings.LOG_LEVEL_FILE.upper()
-    
-    min_level = min(
-        getattr(logging, console_level, logging.INFO),
-        getattr(logging, file_level, logging.DEBUG)
-    )
-    logger.setLevel(min_level)
-
-    # Use a standard format
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
+    logger.setLevel(MIN_LEVEL)
 
     if not logger.handlers:
         # Console Handler
         console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(formatter)
-        console_handler.setLevel(console_level)
+        console_handler.setFormatter(FORMATTER)
+        console_handler.setLevel(CONSOLE_LEVEL)
         logger.addHandler(console_handler)
 
         # File Handler (Rotating)
@@ -41,8 +44,8 @@ def setup_logging(name: str) -> logging.Logger:
             backupCount=settings.LOG_BACKUP_COUNT,
             encoding="utf-8"
         )
-        file_handler.setFormatter(formatter)
-        file_handler.setLevel(file_level)
+        file_handler.setFormatter(FORMATTER)
+        file_handler.setLevel(FILE_LEVEL)
         logger.addHandler(file_handler)
 
     return logger
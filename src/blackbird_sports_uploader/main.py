@@ -1,11 +1,14 @@
 import asyncio
+import functools
 import json
+import os
 from datetime import datetime, timedelta, timezone
-from typing import Set, Tuple, Optional
+from pathlib import Path
+from typing import Iterable, Iterator, Set, Tuple, Optional, TextIO
 
 from .auth import get_session, save_session, authenticate, get_user_info, SessionData
 from .fit_processor import FitProcessor
-from .uploader import compress_xml, upload_record
+from .uploader import encode_record, upload_record
 from .config import settings
 from .logger import setup_logging
 from . import bb16
@@ -13,13 +16,42 @@ from . import bb16
 # Setup logger for main module
 logger = setup_logging("main")
 
+# Prepared (parsed and zipped) records buffered ahead of the uploaders
+PREFETCH_RECORDS = 2
+
+
+BEIJING_TZ = timezone(timedelta(hours=8))
+# 28800000 (UTC+8) - 631065600000 (FIT epoch, 1989-12-31), folded
+FITTIME_OFFSET_MS = 28800000 - 631065600000
+
+BEIJING_OFFSET_S = 8 * 3600
+
 def get_beijing_time(timestamp_ms: int) -> datetime:
-    """Convert UTC timestamp (ms) to Beijing Time (UTC+8)."""
-    utc_dt = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
-    beijing_tz = timezone(timedelta(hours=8))
-    return utc_dt.astimezone(beijing_tz)
+    """
+    Convert UTC timestamp (ms) to Beijing Time (UTC+8).
+    Reference for the integer conversion in generate_params; the tests
+    check one against the other.
+    """
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=BEIJING_TZ)
+
+
+def civil_from_days(days: int) -> Tuple[int, int, int]:
+    """
+    (year, month, day) of a day count since 1970-01-01, using Howard
+    Hinnant's proleptic Gregorian algorithm.
+    """
+    days += 719468  # Shift the epoch to 0000-03-01
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (month <= 2), month, day
 
 
+@functools.lru_cache(maxsize=4096)
 def generate_params(timestamp_ms: int) -> Tuple[str, str]:
     """
     Generate localRecordId and fittime based on DeviceThreeUtil logic.
@@ -27,34 +59,124 @@ def generate_params(timestamp_ms: int) -> Tuple[str, str]:
     j is the UTC timestamp of the record time (derived from parsing logic).
     """
     # 1. localRecordId is the string representation in Beijing Time (likely)
-    beijing_dt = get_beijing_time(timestamp_ms)
-    local_record_id = beijing_dt.strftime("%Y%m%d%H%M%S")
+    # Split with integer math instead of building a datetime; same digits as
+    # get_beijing_time(timestamp_ms).strftime("%Y%m%d%H%M%S")
+    days, secs = divmod(timestamp_ms // 1000 + BEIJING_OFFSET_S, 86400)
+    hour, secs = divmod(secs, 3600)
+    minute, second = divmod(secs, 60)
+    year, month, day = civil_from_days(days)
+    local_record_id = (
+        f"{year:04d}{month:02d}{day:02d}{hour:02d}{minute:02d}{second:02d}"
+    )
 
     # 2. fittime calculation
     # DeviceThreeUtil adds 28800000 (8h) to the input timestamp, then subtracts epoch.
     # This implies the input 'j' is UTC, and we want seconds since 1989 in Beijing Time.
-    fittime = int((timestamp_ms + 28800000 - 631065600000) / 1000)
+    # FIT timestamps never predate the FIT epoch, so floor division matches
+    # the original truncating division.
+    fittime = (timestamp_ms + FITTIME_OFFSET_MS) // 1000
 
     return local_record_id, str(fittime)
 
 
+# (file signatures, history) from the last load_history call
+_history_cache: Optional[Tuple[tuple, frozenset]] = None
+
+
+def file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """Return (mtime_ns, size) of path, or None if it does not exist."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
 def load_history() -> Set[str]:
-    """Load upload history from file."""
-    if settings.UPLOAD_HISTORY_FILE.exists():
+    """
+    Return the upload history, re-reading it only when the snapshot or the
+    journal changed on disk. Most sync cycles upload nothing, so they skip
+    the decode entirely.
+    """
+    global _history_cache
+    key = (
+        file_signature(settings.UPLOAD_HISTORY_FILE),
+        file_signature(settings.UPLOAD_JOURNAL_FILE),
+    )
+    if _history_cache is None or _history_cache[0] != key:
+        _history_cache = key, frozenset(read_history())
+    return set(_history_cache[1])
+
+
+def read_history() -> Set[str]:
+    """Load upload history from the snapshot file plus the append-only journal."""
+    history: Set[str] = set()
+    # Open directly instead of probing with exists(); a missing file is normal
+    try:
+        history.update(json.loads(settings.UPLOAD_HISTORY_FILE.read_bytes()))
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, IOError) as e:
+        logger.warning("Failed to load history: %s", e)
+
+    try:
+        lines = settings.UPLOAD_JOURNAL_FILE.read_text().splitlines()
+    except FileNotFoundError:
+        lines = []
+    except IOError as e:
+        logger.warning("Failed to load history journal: %s", e)
+        lines = []
+
+    if lines:
+        # Decode the whole journal in one C-level pass as a JSON array; only
+        # fall back to line-by-line when some line is damaged.
         try:
-            with open(settings.UPLOAD_HISTORY_FILE, "r") as f:
-                return set(json.load(f))
-        except (json.JSONDecodeError, IOError) as e:
-            logger.warning(f"Failed to load history: {e}")
-            return set()
-    return set()
+            history.update(json.loads("[" + ",".join(lines) + "]"))
+        except json.JSONDecodeError:
+            for line in lines:
+                try:
+                    history.add(json.loads(line))
+                except json.JSONDecodeError:
+                    # Likely a partial line from an interrupted write
+                    logger.warning("Skipping bad history journal line: %r", line)
+
+    return history
+
+
+def open_history_journal() -> Optional[TextIO]:
+    """
+    Open the history journal for one sync cycle. Line buffering still puts
+    every upload on disk as it lands, without reopening the file each time.
+    """
+    try:
+        return open(settings.UPLOAD_JOURNAL_FILE, "a", buffering=1)
+    except IOError as e:
+        logger.error("Failed to open history journal: %s", e)
+        return None
+
+
+def append_history(journal: Optional[TextIO], name: str) -> None:
+    """Record a single upload by appending it to the history journal."""
+    if journal is None:
+        return
+    try:
+        journal.write(json.dumps(name) + "\n")
+    except IOError as e:
+        logger.error("Failed to append history: %s", e)
+
+
+# Built once with compact separators; still plain JSON for load_history
+HISTORY_ENCODER = json.JSONEncoder(separators=(",", ":"))
 
 
 def save_history(history: Set[str]) -> None:
-    """Save upload history to file."""
+    """Rewrite the history snapshot and fold the journal into it."""
+    tmp_file = settings.UPLOAD_HISTORY_FILE.with_suffix(".tmp")
     try:
-        with open(settings.UPLOAD_HISTORY_FILE, "w") as f:
-            json.dump(sorted(history), f, indent=4)
+        # encode() without indent takes the C encoder; json.dump never does
+        tmp_file.write_bytes(HISTORY_ENCODER.encode(sorted(history)).encode())
+        tmp_file.replace(settings.UPLOAD_HISTORY_FILE)
+        settings.UPLOAD_JOURNAL_FILE.unlink(missing_ok=True)
     except IOError as e:
         logger.error(f"Failed to save history: {e}")
 
@@ -89,6 +211,90 @@ def verify_session() -> Optional[SessionData]:
 
     return session
 
+CACHE_HEADER_KEYS = {"key", "record_id", "fittime", "size"}
+
+
+def record_cache_path(path: Path) -> Path:
+    """Sidecar file holding the prepared upload payload for a FIT file."""
+    return path.with_name(path.name + ".cache")
+
+
+def load_cached_record(path: Path, key: str) -> Optional[Tuple[str, str, bytes]]:
+    """Return the cached (record_id, fittime, zip_data) if it matches *key*."""
+    try:
+        data = record_cache_path(path).read_bytes()
+    except FileNotFoundError:
+        return None
+    except IOError as e:
+        logger.warning("Failed to read record cache for %s: %s", path.name, e)
+        return None
+
+    header, _, zip_data = data.partition(b"\n")
+    try:
+        meta = json.loads(header)
+    except json.JSONDecodeError:
+        return None
+    # Anything other than a complete header from save_cached_record is a miss
+    if not isinstance(meta, dict) or not CACHE_HEADER_KEYS <= meta.keys():
+        return None
+    if meta["key"] != key or meta["size"] != len(zip_data):
+        return None
+    return meta["record_id"], meta["fittime"], zip_data
+
+
+def save_cached_record(path: Path, key: str, record_id: str, fittime: str, zip_data: bytes) -> None:
+    """Store a prepared payload so a failed upload can be retried without re-parsing."""
+    header = json.dumps(
+        {"key": key, "record_id": record_id, "fittime": fittime, "size": len(zip_data)}
+    )
+    cache_path = record_cache_path(path)
+    try:
+        tmp = cache_path.with_name(cache_path.name + ".tmp")
+        tmp.write_bytes(header.encode() + b"\n" + zip_data)
+        tmp.replace(cache_path)
+    except IOError as e:
+        logger.warning("Failed to write record cache for %s: %s", path.name, e)
+
+
+def prepare_record(path: Path, account_id: int) -> Tuple[str, str, bytes]:
+    """
+    Parse a FIT file and build its upload payload.
+    Returns (record_id, fittime, zip_data), reusing a cached payload from an
+    earlier failed upload when the file is unchanged.
+    """
+    st = path.stat()
+    key = f"{st.st_size}-{st.st_mtime_ns}-{account_id}-{settings.UPLOAD_FORMAT}"
+    cached = load_cached_record(path, key)
+    if cached:
+        logger.info("Using cached payload for %s", path.name)
+        return cached
+
+    processor = FitProcessor(os.fspath(path), account_id)
+    processor.parse()
+    xml_content = processor.generate_xml()
+    timestamp_ms = int(processor.start_time)
+
+    record_id, fittime = generate_params(timestamp_ms)
+    zip_data = encode_record(
+        xml_content, record_id, settings.UPLOAD_FORMAT, settings.ZIP_COMPRESS_LEVEL
+    )
+    save_cached_record(path, key, record_id, fittime, zip_data)
+    return record_id, fittime, zip_data
+
+def iter_new_records(
+    entries: Iterable[os.DirEntry], history: Set[str]
+) -> Iterator[Path]:
+    """
+    Yield the .fit records among directory entries that are not in history.
+    Names and d_type come straight from the dirent, so only new records get
+    a Path built for them.
+    """
+    for entry in entries:
+        name = entry.name
+        if name.endswith(".fit") and name not in history and entry.is_file():
+            yield Path(entry.path)
+
+
 async def do_sync(session: SessionData) -> bool:
     """
     Synchronizing data from device to server
@@ -98,34 +304,104 @@ async def do_sync(session: SessionData) -> bool:
         return False
 
     history = load_history()
-    new_files = [f for f in settings.DATA_DIR.glob("*.fit") if f.name not in history]
-    logger.info(f"Found {len(new_files)} new records.")
-
     account_id = int(session.accountId)
-    for f in new_files:
-        logger.info(f"Processing {f.name}...")
+    # Token and format are fixed for the cycle; bind them once
+    upload = functools.partial(
+        upload_record, session.token, upload_format=settings.UPLOAD_FORMAT
+    )
+    workers = max(1, settings.UPLOAD_WORKERS)
+    uploaded = 0
+    # Pipeline: parsing is CPU-bound and holds the GIL, so a single producer
+    # prepares records in order while the consumers upload earlier ones. The
+    # bounded queue caps how many prepared payloads wait in memory. More
+    # preparing threads would only overlap the deflate step (a few percent of
+    # prepare_record); fitdecode itself is pure Python.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_RECORDS)
+
+    async def produce():
+        found = 0
         try:
-            processor = FitProcessor(str(f), account_id)
-            processor.parse()
-            xml_content = processor.generate_xml()
-            timestamp_ms = int(processor.start_time)
-                        
-            record_id, fittime = generate_params(timestamp_ms)
-            zip_data = compress_xml(xml_content, record_id)
-        except Exception as e:
-            logger.error(f'Error processing {f.name}: {e}')
-            continue
-
-        logger.info(f"Uploading {f.name} (ID: {record_id})...")
-        # upload_record is synchronous (requests). That's fine for now, 
-        # or we could make it async later.
-        if not upload_record(session.token, zip_data, record_id, fittime):
-            logger.error(f"Failed to upload {f.name}")
-            continue
-
-        logger.info(f"Upload successful: {f.name}")
-        history.add(f.name)
-        save_history(history)
+            with entries:
+                # The first record is being prepared while the scan goes on
+                for f in iter_new_records(entries, history):
+                    found += 1
+                    logger.info("Processing %s...", f.name)
+                    try:
+                        payload = await asyncio.to_thread(prepare_record, f, account_id)
+                    except Exception as e:
+                        logger.error("Error processing %s: %s", f.name, e)
+                        continue
+                    await queue.put((f, *payload))
+        finally:
+            # A cancelled producer skips the sentinels: the consumers are
+            # being cancelled too and may never drain the queue.
+            if not asyncio.current_task().cancelling():
+                for _ in range(workers):
+                    await queue.put(None)
+        logger.info("Found %d new records.", found)
+
+    async def consume():
+        nonlocal uploaded, journal
+        while (item := await queue.get()) is not None:
+            path, record_id, fittime, zip_data = item
+            name = path.name
+            logger.info("Uploading %s (ID: %s)...", name, record_id)
+            try:
+                ok = await asyncio.to_thread(upload, zip_data, record_id, fittime)
+            except Exception as e:
+                logger.error("Error uploading %s: %s", name, e)
+                ok = False
+            if not ok:
+                logger.error("Failed to upload %s", name)
+                continue
+
+            logger.info("Upload successful: %s", name)
+            # Runs on the event loop, so history needs no lock. Journal each
+            # upload (O(1)) and compact once per cycle.
+            history.add(name)
+            if journal is None:
+                journal = open_history_journal()
+            append_history(journal, name)
+            record_cache_path(path).unlink(missing_ok=True)
+            uploaded += 1
+
+    journal: Optional[TextIO] = None
+    # Opened last so nothing between here and the pipeline can leak it; a
+    # missing directory still fails before any record is read, and the
+    # producer consumes the scan lazily.
+    entries = os.scandir(settings.DATA_DIR)
+    producer = asyncio.create_task(produce())
+    tasks = [producer, *(asyncio.create_task(consume()) for _ in range(workers))]
+    try:
+        # produce() queues the sentinels even when it raises, so after a
+        # failed scan the consumers still upload what was already prepared.
+        # A failed consumer would stall the producer on a full queue
+        # instead, so stop the whole pipeline then.
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_EXCEPTION
+            )
+            if any(t is not producer and t.exception() for t in done):
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # In case the producer was cancelled before it took over the scan
+        entries.close()
+        # No consumer is left to touch the journal or history
+        if journal:
+            journal.close()
+
+        # One snapshot rewrite per cycle. A journal left by an interrupted
+        # cycle is folded in too, even when nothing new was uploaded this time.
+        if uploaded or settings.UPLOAD_JOURNAL_FILE.exists():
+            save_history(history)
+
+    for task in tasks:
+        if not task.cancelled() and task.exception():
+            raise task.exception()
 
     logger.info("All records processed.")
     return True
@@ -1,31 +1,177 @@
-import zipfile
+import gzip
+import json
+import os
+import struct
+import zlib
 import requests
-import io
+from typing import Tuple
+from .auth import http_session
 from .config import settings
 from .logger import setup_logging
 
 logger = setup_logging(__name__)
 
 
-def compress_xml(xml_content: str, record_id: str) -> bytes:
+# ZIP record layouts (little-endian), as in zipfile's structFileHeader,
+# structCentralDir and structEndArchive
+ZIP_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+ZIP_CENTRAL_DIR = struct.Struct("<4s4B4HL2L5H2L")
+ZIP_END_ARCHIVE = struct.Struct("<4s4H2LH")
+ZIP_VERSION = 20  # Deflate needs 2.0
+ZIP_DEFLATED = 8
+ZIP_UNIX = 3
+ZIP_FILE_MODE = 0o600 << 16  # What zipfile.writestr gives member names
+# Fixed member timestamp (1980-01-01 00:00, the DOS epoch) so the archive
+# depends only on its content
+ZIP_DOS_TIME = 0
+ZIP_DOS_DATE = 1 << 5 | 1
+
+# Request parts that never change between uploads
+UPLOAD_URL = f"{settings.BASE_URL}/bk_uploadRecord"
+UPLOAD_DEVICE_PARAMS = {
+    "deviceType": settings.DEVICE_TYPE,
+    "sn": settings.DEVICE_SN,
+}
+
+
+def compress_xml(
+    xml_content: str | bytes, record_id: str, compresslevel: int = 6
+) -> bytes:
     """
     Compresses the XML content into a ZIP file.
 
+    The single-member archive is assembled by hand around one raw deflate
+    stream, so the payload is encoded and compressed once with no
+    intermediate BytesIO. The layout matches what zipfile.writestr produces,
+    with a fixed member timestamp so equal XML gives equal archives.
+
     Args:
-        xml_content: The XML string to compress.
+        xml_content: The XML to compress; str is encoded as UTF-8, bytes
+            are used as-is.
         record_id: The record ID used for the filename.
+        compresslevel: zlib level, trading CPU time for archive size.
 
     Returns:
         Bytes of the ZIP file.
     """
-    logger.debug(f"Compressing XML for record {record_id}")
-    filename = f"sportRecord_{record_id}.xml"
+    logger.debug("Compressing XML for record %s", record_id)
+    filename = f"sportRecord_{record_id}.xml".encode("ascii")
+    data = (
+        xml_content.encode("utf-8") if isinstance(xml_content, str) else xml_content
+    )
+
+    # A fresh compressor is cheaper than copying a template one
+    deflater = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    body = deflater.compress(data)
+    tail = deflater.flush()
+    compressed_size = len(body) + len(tail)
+    crc = zlib.crc32(data)
+
+    local_header = ZIP_LOCAL_HEADER.pack(
+        b"PK\x03\x04", ZIP_VERSION, 0, 0, ZIP_DEFLATED,
+        ZIP_DOS_TIME, ZIP_DOS_DATE, crc, compressed_size, len(data),
+        len(filename), 0,
+    )
+    central_offset = len(local_header) + len(filename) + compressed_size
+    central_dir = ZIP_CENTRAL_DIR.pack(
+        b"PK\x01\x02", ZIP_VERSION, ZIP_UNIX, ZIP_VERSION, 0, 0,
+        ZIP_DEFLATED, ZIP_DOS_TIME, ZIP_DOS_DATE, crc, compressed_size, len(data),
+        len(filename), 0, 0, 0, 0, ZIP_FILE_MODE, 0,
+    )
+    end_archive = ZIP_END_ARCHIVE.pack(
+        b"PK\x05\x06", 0, 0, 1, 1,
+        len(central_dir) + len(filename), central_offset, 0,
+    )
+
+    # One join is the only copy of the compressed data
+    return b"".join(
+        (local_header, filename, body, tail, central_dir, filename, end_archive)
+    )
+
+
+def encode_record(
+    xml_content: str,
+    record_id: str,
+    upload_format: str = "zip",
+    compresslevel: int = 6,
+) -> bytes:
+    """
+    Encode the XML record body for the given upload format.
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        zip_file.writestr(filename, xml_content)
+    "zip" is the archive the official app sends. "gzip" and "raw" skip the
+    ZIP container and are only useful against a server that accepts them.
+    """
+    if upload_format == "zip":
+        return compress_xml(xml_content, record_id, compresslevel)
+    data = xml_content.encode("utf-8")
+    if upload_format == "gzip":
+        return gzip.compress(data, compresslevel, mtime=0)
+    if upload_format == "raw":
+        return data
+    raise ValueError(f"Unknown upload format: {upload_format}")
 
-    return zip_buffer.getvalue()
+
+class MultipartBody:
+    """
+    Read-only file-like view over the parts of a request body.
+
+    requests sizes it with len() and urllib3 sends it in blocks via read(),
+    so the record payload is never copied into one joined body. tell() and
+    seek() let urllib3 rewind it when a request is retried.
+    """
+
+    def __init__(self, *parts: bytes):
+        self._parts = [memoryview(part) for part in parts]
+        self._size = sum(len(part) for part in parts)
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = self._size
+        if size is not None and size >= 0:
+            end = min(self._pos + size, end)
+        chunks = []
+        start = 0
+        for part in self._parts:
+            part_end = start + len(part)
+            if part_end > self._pos and start < end:
+                chunks.append(part[max(self._pos - start, 0) : end - start])
+            start = part_end
+        self._pos = end
+        return b"".join(chunks)
+
+
+def multipart_file(
+    name: str, filename: str, data: bytes, content_type: str
+) -> Tuple[MultipartBody, str]:
+    """
+    Encode a single-file multipart/form-data body the way requests' files=
+    does, returning (body, Content-Type header).
+    """
+    boundary = os.urandom(16).hex()
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode("utf-8")
+    tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+    return (
+        MultipartBody(head, data, tail),
+        f"multipart/form-data; boundary={boundary}",
+    )
 
 
 def upload_record(
@@ -33,50 +179,60 @@ def upload_record(
     zip_data: bytes,
     record_id: str,
     fittime: str,
+    upload_format: str = "zip",
 ) -> bool:
     """
     Upload the compressed record to the server.
 
     Args:
         token: Session token.
-        zip_data: Compressed XML record.
+        zip_data: Record body as built by encode_record.
         record_id: Local record ID (timestamp string).
         fittime: FIT timestamp string (ms).
+        upload_format: The format zip_data was encoded with. "zip" goes as
+            the multipart RecordFile; the others are posted as the XML body.
 
     Returns:
         True if upload successful, False otherwise.
     """
-    url = f"{settings.BASE_URL}/bk_uploadRecord"
-
-    logger.info(f"Uploading record {record_id} (fittime={fittime})")
-
-    files = {
-        "RecordFile": (f"sportRecord_{record_id}.zip", zip_data, "application/zip")
-    }
+    logger.info("Uploading record %s (fittime=%s)", record_id, fittime)
 
     params = {
         "ton": token,
-        "deviceType": settings.DEVICE_TYPE,
-        "sn": settings.DEVICE_SN,
+        **UPLOAD_DEVICE_PARAMS,
         "fittime": fittime,
         "localRecordId": record_id,
     }
 
-    headers = {
-        "User-Agent": settings.USER_AGENT
-    }
-
     try:
-        response = requests.post(
-            url, files=files, params=params, headers=headers, timeout=30
+        if upload_format == "zip":
+            body, content_type = multipart_file(
+                "RecordFile",
+                f"sportRecord_{record_id}.zip",
+                zip_data,
+                "application/zip",
+            )
+            headers = {"Content-Type": content_type}
+        else:
+            body = zip_data
+            headers = {"Content-Type": "application/xml"}
+            if upload_format == "gzip":
+                headers["Content-Encoding"] = "gzip"
+        response = http_session.post(
+            UPLOAD_URL, data=body, params=params, headers=headers, timeout=30
         )
-        result = response.json()
+        # json.loads detects the UTF encoding of the raw bytes itself, which
+        # skips requests' text decoding and encoding guess
+        result = json.loads(response.content)
         if result.get("status") != "ok":
             error_msg = result.get("msg", "Unknown error")
-            logger.error(f"Upload failed: {error_msg}. Response: {result}")
+            logger.error("Upload failed: %s. Response: %s", error_msg, result)
             return False
-        logger.info(f"Upload successful for record {record_id}")
+        logger.info("Upload successful for record %s", record_id)
         return True
     except requests.RequestException as e:
-        logger.error(f"Network error during upload: {e}")
+        logger.error("Network error during upload: %s", e)
+        return False
+    except ValueError as e:
+        logger.error("Invalid upload response: %s", e)
         return False
@@ -0,0 +1,56 @@
+import pathlib
+import time
+import pytest
+from blackbird_sports_uploader.fit_processor import FitProcessor
+
+TESTS_DIR = pathlib.Path(__file__).parent
+
+# ride.fit holds five one-second records starting 2025-08-05 08:00:00 UTC:
+#   0: both speed (3.0) and enhanced_speed (5.0)
+#   1: invalid position_lat
+#   2: invalid heart_rate and power
+#   3: speed only (2.5)
+#   4: enhanced_speed only (5.4)
+# empty.fit has the same session message but no records.
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(time, "time", lambda: 1754380900.5)
+
+def parse(name):
+    processor = FitProcessor(str(TESTS_DIR / name), 12345)
+    processor.parse()
+    return processor
+
+def test_generate_xml_matches_golden(frozen_time):
+    processor = parse("ride.fit")
+    assert processor.num_points == 5
+    assert processor.generate_xml() == (TESTS_DIR / "ride.xml").read_text()
+
+def test_empty_record_has_empty_track(frozen_time):
+    processor = parse("empty.fit")
+    assert processor.num_points == 0
+    xml = processor.generate_xml()
+    assert "    <track/>\n" in xml
+    assert "<time>1754380900500</time>" in xml
+    assert xml == (TESTS_DIR / "empty.xml").read_text()
+
+def test_invalid_values_become_zero():
+    processor = parse("ride.fit")
+    bad_lat = processor.point(1)
+    assert bad_lat.lat == 0.0
+    assert bad_lat.lng == pytest.approx(116.300008, abs=1e-6)
+    bad_sensors = processor.point(2)
+    assert (bad_sensors.heart_rate, bad_sensors.power) == (0, 0)
+    assert bad_sensors.cadence == 82
+
+def test_speed_precedence():
+    processor = parse("ride.fit")
+    speeds = [processor.point(i).speed for i in range(processor.num_points)]
+    # fitdecode expands speed into an enhanced_speed component ahead of the
+    # native field; like get_value(), the first one wins.
+    assert speeds[0] == pytest.approx(3.0)
+    # Without enhanced_speed, speed is used
+    assert speeds[3] == pytest.approx(2.5)
+    # Without a speed field, enhanced_speed is used
+    assert speeds[4] == pytest.approx(5.4)
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+import pytest
+
+import blackbird_sports_uploader.main as main
+from blackbird_sports_uploader.config import settings
+from blackbird_sports_uploader.main import (
+    civil_from_days,
+    do_sync,
+    generate_params,
+    get_beijing_time,
+    iter_new_records,
+    load_cached_record,
+    load_history,
+    record_cache_path,
+    save_cached_record,
+    save_history,
+)
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(main, "_history_cache", None)
+    return tmp_path
+
+def test_civil_from_days():
+    for days in (0, 59, 60, 11016, 11017, 20305, 47541, -1):
+        expected = datetime.fromtimestamp(days * 86400, tz=timezone.utc).date()
+        assert civil_from_days(days) == (expected.year, expected.month, expected.day)
+
+def test_generate_params():
+    # 2025-08-05 08:00:00 UTC is 16:00 in Beijing
+    record_id, fittime = generate_params(1754380800123)
+    assert record_id == "20250805160000"
+    assert fittime == str((1754380800123 + 28800000 - 631065600000) // 1000)
+    # Leap day, one second before midnight Beijing time
+    assert generate_params(951839999000)[0] == "20000229235959"
+
+def test_generate_params_matches_datetime():
+    rng = random.Random(0)
+    # From the FIT epoch to 2100, plus a sweep through leap year 2000 (Beijing
+    # time) that drifts across the time of day
+    timestamps = [rng.randrange(631065600000, 4102444800000) for _ in range(10000)]
+    timestamps += range(946656000000 - 1000, 978278400000, 43200000 - 1)
+    for ts in timestamps:
+        expected = get_beijing_time(ts).strftime("%Y%m%d%H%M%S")
+        assert generate_params.__wrapped__(ts)[0] == expected, ts
+
+def test_cached_record_round_trip(tmp_path):
+    fit = tmp_path / "a.fit"
+    save_cached_record(fit, "k", "20250805160000", "12345", b"payload")
+    assert load_cached_record(fit, "k") == ("20250805160000", "12345", b"payload")
+    assert load_cached_record(fit, "other") is None
+    assert [p.name for p in tmp_path.iterdir()] == ["a.fit.cache"]
+
+def test_truncated_cached_record_is_a_miss(tmp_path):
+    fit = tmp_path / "a.fit"
+    save_cached_record(fit, "k", "20250805160000", "12345", b"payload")
+    cache = record_cache_path(fit)
+    cache.write_bytes(cache.read_bytes()[:-1])
+    assert load_cached_record(fit, "k") is None
+
+def test_bad_cached_record_header_is_a_miss(tmp_path):
+    fit = tmp_path / "a.fit"
+    headers = (
+        b"5",
+        b"[]",
+        b"not json",
+        b'{"key": "k", "record_id": "20250805160000", "size": 7}',
+    )
+    for header in headers:
+        record_cache_path(fit).write_bytes(header + b"\npayload")
+        assert load_cached_record(fit, "k") is None
+
+def test_history_unions_snapshot_and_journal(data_dir):
+    settings.UPLOAD_HISTORY_FILE.write_text(json.dumps(["a.fit", "b.fit"]))
+    settings.UPLOAD_JOURNAL_FILE.write_text('"b.fit"\n"c.fit"\n')
+    assert load_history() == {"a.fit", "b.fit", "c.fit"}
+
+def test_history_skips_damaged_journal_line(data_dir):
+    # An interrupted append leaves a partial last line
+    settings.UPLOAD_JOURNAL_FILE.write_text('"a.fit"\n"b.fit"\n"c.f')
+    assert load_history() == {"a.fit", "b.fit"}
+
+def test_save_history_folds_in_journal(data_dir):
+    settings.UPLOAD_JOURNAL_FILE.write_text('"a.fit"\n')
+    save_history({"a.fit", "b.fit"})
+    assert not settings.UPLOAD_JOURNAL_FILE.exists()
+    assert not settings.UPLOAD_HISTORY_FILE.with_suffix(".tmp").exists()
+    assert json.loads(settings.UPLOAD_HISTORY_FILE.read_text()) == ["a.fit", "b.fit"]
+    assert load_history() == {"a.fit", "b.fit"}
+
+def test_load_history_rereads_changed_files(data_dir):
+    assert load_history() == set()
+    settings.UPLOAD_HISTORY_FILE.write_text(json.dumps(["a.fit"]))
+    assert load_history() == {"a.fit"}
+    settings.UPLOAD_JOURNAL_FILE.write_text('"b.fit"\n')
+    assert load_history() == {"a.fit", "b.fit"}
+    settings.UPLOAD_HISTORY_FILE.write_text(json.dumps(["a.fit", "c.fit"]))
+    assert load_history() == {"a.fit", "b.fit", "c.fit"}
+    # Callers get their own copy; mutating it must not touch the cache
+    load_history().add("d.fit")
+    assert load_history() == {"a.fit", "b.fit", "c.fit"}
+
+def test_iter_new_records_matches_glob(tmp_path):
+    for name in ("a.fit", ".b.fit", "c.fit", "d.txt", "a.fit.cache"):
+        (tmp_path / name).touch()
+    (tmp_path / "e.fit").mkdir()
+    with os.scandir(tmp_path) as entries:
+        found = sorted(p.name for p in iter_new_records(entries, {"c.fit"}))
+    assert found == [".b.fit", "a.fit"]
+
+@pytest.fixture
+def sync_env(data_dir, monkeypatch):
+    """Run do_sync against data_dir with the device and server faked out."""
+    uploads = []
+    fail = {"prepare": set(), "reject": set(), "raise": set()}
+
+    async def download():
+        return True
+
+    def prepare_record(path, account_id):
+        if path.name in fail["prepare"]:
+            raise ValueError("bad FIT file")
+        save_cached_record(path, "k", path.stem, "0", b"zip")
+        return path.stem, "0", b"zip"
+
+    def upload_record(token, zip_data, record_id, fittime, upload_format):
+        if record_id + ".fit" in fail["raise"]:
+            raise ConnectionError("reset")
+        if record_id + ".fit" in fail["reject"]:
+            return False
+        uploads.append(record_id)
+        return True
+
+    monkeypatch.setattr(main.bb16, "download", download)
+    monkeypatch.setattr(main, "prepare_record", prepare_record)
+    monkeypatch.setattr(main, "upload_record", upload_record)
+
+    def run(*names):
+        for name in names:
+            (data_dir / name).touch()
+        session = SimpleNamespace(accountId="1", token="t")
+        return asyncio.run(do_sync(session))
+
+    return SimpleNamespace(run=run, uploads=uploads, fail=fail, dir=data_dir)
+
+def saved_history():
+    return set(json.loads(settings.UPLOAD_HISTORY_FILE.read_text()))
+
+def test_do_sync_uploads_new_records(sync_env):
+    settings.UPLOAD_HISTORY_FILE.write_text(json.dumps(["a.fit"]))
+    # A journal left by an interrupted cycle is folded in
+    settings.UPLOAD_JOURNAL_FILE.write_text('"b.fit"\n')
+    assert sync_env.run("a.fit", "b.fit", "c.fit", "d.fit", "e.txt")
+    assert sorted(sync_env.uploads) == ["c", "d"]
+    assert saved_history() == {"a.fit", "b.fit", "c.fit", "d.fit"}
+    assert not settings.UPLOAD_JOURNAL_FILE.exists()
+    assert not list(sync_env.dir.glob("*.cache"))
+
+def test_do_sync_keeps_failed_records_for_retry(sync_env):
+    sync_env.fail["prepare"].add("a.fit")
+    sync_env.fail["reject"].add("b.fit")
+    sync_env.fail["raise"].add("c.fit")
+    assert sync_env.run("a.fit", "b.fit", "c.fit", "d.fit")
+    assert sync_env.uploads == ["d"]
+    assert saved_history() == {"d.fit"}
+    # Only successful uploads drop their prepared payload
+    assert sorted(p.name for p in sync_env.dir.glob("*.cache")) == [
+        "b.fit.cache",
+        "c.fit.cache",
+    ]
+
+    sync_env.fail["reject"].clear()
+    sync_env.fail["raise"].clear()
+    assert sync_env.run()
+    assert sorted(sync_env.uploads) == ["b", "c", "d"]
+    assert saved_history() == {"b.fit", "c.fit", "d.fit"}
+
+def test_do_sync_records_uploads_when_scan_fails(sync_env, monkeypatch):
+    names = [f"{i}.fit" for i in range(5)]
+
+    def failing_scan(entries, history):
+        for i, path in enumerate(sorted(Path(e.path) for e in entries)):
+            if i == 2:
+                raise OSError("disk went away")
+            yield path
+
+    monkeypatch.setattr(main, "iter_new_records", failing_scan)
+    with pytest.raises(OSError):
+        sync_env.run(*names)
+    # The records prepared before the failure still finish uploading
+    assert sorted(sync_env.uploads) == ["0", "1"]
+    assert saved_history() == {"0.fit", "1.fit"}
+    assert not settings.UPLOAD_JOURNAL_FILE.exists()
+
+def test_do_sync_stops_when_a_consumer_fails(sync_env, monkeypatch):
+    def broken_journal(journal, name):
+        raise RuntimeError("journal broken")
+
+    monkeypatch.setattr(main, "append_history", broken_journal)
+    names = [f"{i}.fit" for i in range(20)]
+    with pytest.raises(RuntimeError):
+        sync_env.run(*names)
+    # Uploads recorded before the failure still reach the snapshot; one
+    # cut off by the cancellation is retried next cycle.
+    assert saved_history()
+    assert saved_history() <= {f"{name}.fit" for name in sync_env.uploads}
@@ -1,4 +1,6 @@
+import asyncio
 import pathlib
+from types import SimpleNamespace
 import pytest
 import blackbird_sports_uploader.bb16 as bb16
 
@@ -32,6 +34,34 @@ def test_message_framing_escape():
     unescaped = bb16.Message.unescape(escaped)
     assert unescaped == original
 
+def test_message_escape_all_bytes():
+    original = bytes(range(256)) * 2
+    escaped = bb16.Message.escape(original)
+
+    assert b"\x7e" not in escaped
+    assert b"\x7f" not in escaped
+    assert escaped.count(b"\x7d") == 6
+    assert bb16.Message.escape(bytes(range(0x7B, 0x81))) == bytes.fromhex(
+        "7b7c7d017d027d0380"
+    )
+    assert bb16.Message.unescape(escaped) == original
+
+def test_message_escape_dense():
+    # Mostly reserved bytes exercises the replace-based unescape path
+    original = b"\x7d\x7e\x7f\x01\x02\x03" * 50
+    escaped = bb16.Message.escape(original)
+    assert bb16.Message.unescape(escaped) == original
+    with pytest.raises(AssertionError, match="escape sequence value"):
+        bb16.Message.unescape(escaped + b"\x7d\x7d\x01")
+
+def test_message_unescape_invalid():
+    with pytest.raises(AssertionError, match="end of packet"):
+        bb16.Message.unescape(b"\x01\x7d")
+    with pytest.raises(AssertionError, match="escape sequence value"):
+        bb16.Message.unescape(b"\x7d\x04")
+    with pytest.raises(AssertionError, match="escape sequence value"):
+        bb16.Message.unescape(b"\x7d\x7d\x01")
+
 def test_message_to_bytes():
     # Create a GetFile message
     msg = bb16.GetFile(filename="test.txt", sid=1)
@@ -71,6 +101,89 @@ def test_checksum_verification():
     with pytest.raises(AssertionError, match="crc mismatch"):
         bb16.Message.from_bytes(corrupted_data)
 
+def test_checksum_algorithm():
+    # Frames use CRC-16/CCITT-FALSE; from_bytes relies on its zero residue
+    import binascii
+    assert binascii.crc_hqx(b"123456789", 0xFFFF) == 0x29B1
+    data = bb16.Message.unescape(bb16.GetFile(filename="test.txt").to_bytes()[1:-1])
+    assert binascii.crc_hqx(data, 0xFFFF) == 0
+
+def test_packet_stream_reassembly():
+    stream = bb16.PacketStream(None, bb16.UUID_COMMON_PUSH)
+    first = bb16.GetFile(filename="Setting.json", sid=1).to_bytes()
+    second = bb16.FileInfo(filename="a.fit", size=1234, sid=2).to_bytes()
+
+    # A frame split across notifications, then two frames in one notification
+    stream.on_notify("", first[:5])
+    stream.on_notify("", first[5:])
+    stream.on_notify("", second + first)
+
+    assert [m.sid for m in stream.rx_messages] == [1, 2, 1]
+    assert stream.rx_messages[1].size == 1234
+    assert len(stream.rx_buf) == 0
+
+class FakeClient:
+    def __init__(self, properties):
+        self.writes = []
+        char = SimpleNamespace(properties=properties)
+        self.services = SimpleNamespace(get_characteristic=lambda uuid: char)
+
+    async def start_notify(self, uuid, callback):
+        pass
+
+    async def write_gatt_char(self, uuid, data, response=None):
+        self.writes.append((data, response))
+
+def test_packet_stream_ack_write_mode(monkeypatch):
+    async def no_sleep(delay):
+        pass
+
+    async def exchange(properties):
+        client = FakeClient(properties)
+        stream = await bb16.PacketStream.create(client, bb16.UUID_COMMON_PUSH)
+        await stream.write(bb16.GetFile(filename="a.fit"))
+        stream.on_notify("", bb16.FileInfo(filename="a.fit", size=1, sid=0).to_bytes())
+        await stream.read()
+        return [response for _, response in client.writes]
+
+    monkeypatch.setattr(bb16.asyncio, "sleep", no_sleep)
+    # Commands always leave the write mode to bleak; acks skip the write
+    # response only when the characteristic supports it
+    assert asyncio.run(exchange(["write", "write-without-response", "notify"])) == [None, False]
+    assert asyncio.run(exchange(["write", "notify"])) == [None, None]
+
+def test_prebuilt_frames():
+    prebuilt = (bb16.GetAck, bb16.PushAck, bb16.GetDeviceInfoRequest, bb16.GetFileStatus)
+    for cls in prebuilt:
+        for sid in range(16):
+            frame = bb16.Message.to_bytes(cls(sid=sid))
+            assert cls(sid=sid).to_bytes() == frame
+            assert cls().to_bytes(sid_override=sid) == frame
+            assert bb16.Message.from_bytes(frame) == cls(sid=sid)
+
+    msg = bb16.ReceiveFile(seq=1, flag=bb16.ReceiveFileFlag.Last, data=b"", sid=3)
+    assert bb16.ACK_FRAMES[msg.cmd_type][3] == msg.ack().to_bytes()
+
+def test_receive_file_roundtrip():
+    for flag in bb16.ReceiveFileFlag:
+        msg = bb16.ReceiveFile(seq=7, flag=flag, data=b"\x7d\x7e\x7f" * 40, sid=9)
+        parsed = bb16.Message.from_bytes(msg.to_bytes())
+        assert parsed == msg
+        assert parsed.flag is flag
+
+def test_file_info_parse():
+    for size in (0, 1, -1, 1234, -(2**40)):
+        payload = bb16.FileInfo._ProtoDef(filename="20250101.fit", size=size).dumps()
+        assert bb16.FileInfo.parse_payload(payload) == {
+            "filename": "20250101.fit",
+            "size": size,
+        }
+    # Unknown fields are skipped
+    assert bb16.FileInfo.parse_payload(bytes.fromhex("18ff010a01611009")) == {
+        "filename": "a",
+        "size": -5,
+    }
+
 def test_parsing_captured_packets():
     # Load captured packets from file relative to this test file
     current_dir = pathlib.Path(__file__).parent
@@ -95,3 +208,78 @@ def test_message_parsing():
     data = bytes.fromhex("7e100029000108021a0456322e31220656312e302e372a0731343636313933320456312e3038c801f08d7f")
     msg = bb16.Message.from_bytes(data)
     print(msg)
+
+class FakeStream:
+    def __init__(self, *messages):
+        self.messages = list(messages)
+
+    async def write(self, message, response=None):
+        pass
+
+    async def read(self):
+        if not self.messages:
+            raise TimeoutError("No data received within timeout")
+        return self.messages.pop(0)
+
+def fake_device(get, push):
+    device = bb16.BB16.__new__(bb16.BB16)
+    device.get_stream = FakeStream(*get)
+    device.push_stream = FakeStream(*push)
+    return device
+
+def file_transfer(name, *chunks):
+    Flag = bb16.ReceiveFileFlag
+    flags = [Flag.Single]
+    if len(chunks) > 1:
+        flags = [Flag.First] + [Flag.Middle] * (len(chunks) - 2) + [Flag.Last]
+    return [bb16.FileInfo(filename=name, size=sum(map(len, chunks)))] + [
+        bb16.ReceiveFile(seq=i, flag=flag, data=chunk)
+        for i, (flag, chunk) in enumerate(zip(flags, chunks))
+    ]
+
+def test_download_file_in_memory():
+    transfer = file_transfer("a.txt", b"ab", b"c", b"d")
+    device = fake_device([bb16.GetFileResponse(exist=True)], transfer)
+    assert asyncio.run(device.download_file("a.txt")) == b"abcd"
+
+def test_save_file(tmp_path):
+    transfer = file_transfer("a.fit", b"ab", b"cd")
+    device = fake_device([bb16.GetFileResponse(exist=True)], transfer)
+    path = asyncio.run(device.save_file("a.fit", str(tmp_path)))
+    assert path == str(tmp_path / "a.fit")
+    assert (tmp_path / "a.fit").read_bytes() == b"abcd"
+    assert [p.name for p in tmp_path.iterdir()] == ["a.fit"]
+
+def test_save_file_interrupted_leaves_nothing(tmp_path):
+    # The Last fragment never arrives
+    transfer = file_transfer("a.fit", b"ab", b"cd")[:-1]
+    device = fake_device([bb16.GetFileResponse(exist=True)], transfer)
+    with pytest.raises(TimeoutError):
+        asyncio.run(device.save_file("a.fit", str(tmp_path)))
+    assert list(tmp_path.iterdir()) == []
+
+def test_download_records_without_filelist(tmp_path):
+    # A filelist.txt from an earlier sync must not be reused
+    (tmp_path / "filelist.txt").write_text("20250101000000.fit 4\n")
+    device = fake_device([bb16.GetFileResponse(exist=False)], [])
+    assert asyncio.run(device.download_records(str(tmp_path), 100000)) == []
+
+def test_download_records(tmp_path):
+    listing = b"20250101000000.fit 4\n20250102000000.fit 2\n"
+    (tmp_path / "20250102000000.fit").write_bytes(b"ok")
+    device = fake_device(
+        [bb16.GetFileResponse(exist=True)] * 2,
+        file_transfer("filelist.txt", listing[:10], listing[10:])
+        + file_transfer("20250101000000.fit", b"abcd"),
+    )
+    names = asyncio.run(device.download_records(str(tmp_path), 100000))
+    assert names == ["20250101000000.fit"]
+    assert (tmp_path / "20250101000000.fit").read_bytes() == b"abcd"
+
+def test_receive_file_invalid_flag():
+    header = bb16.CmdType.Push.value << 6 | bb16.TransType.Default.value << 4
+    payload = bb16.FRAME_U16.pack(bb16.Oid.ReceiveFile.value) + b"\x00\x09data"
+    with pytest.raises(ValueError, match="Invalid ReceiveFile flag"):
+        bb16.Message.from_bytes(bb16.encode_frame(header, payload))
+    with pytest.raises(ValueError, match="Invalid ReceiveFile flag"):
+        bb16.ReceiveFile.parse_payload(b"\x00\x09data")
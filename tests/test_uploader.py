@@ -0,0 +1,50 @@
+import gzip
+import io
+import zipfile
+import pytest
+from urllib3.filepost import encode_multipart_formdata
+from blackbird_sports_uploader.uploader import compress_xml, encode_record, multipart_file
+
+def test_compress_xml_is_valid_zip():
+    xml = "<sportRecord>" + "1.000000,2.000000,3,4,5,6,7,8,9;" * 500 + "</sportRecord>"
+    data = compress_xml(xml, "20250805160000")
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        (info,) = zf.infolist()
+        assert info.filename == "sportRecord_20250805160000.xml"
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.date_time == (1980, 1, 1, 0, 0, 0)
+        assert zf.read(info).decode("utf-8") == xml
+    assert compress_xml(xml, "20250805160000") == data
+
+def test_compress_xml_empty():
+    with zipfile.ZipFile(io.BytesIO(compress_xml("", "1"))) as zf:
+        assert zf.read("sportRecord_1.xml") == b""
+
+def test_compress_xml_bytes_and_level():
+    xml = "<sportRecord>" + "1.0,2.0;" * 500 + "</sportRecord>"
+    fast = compress_xml(xml.encode("utf-8"), "1", compresslevel=1)
+    with zipfile.ZipFile(io.BytesIO(fast)) as zf:
+        assert zf.read("sportRecord_1.xml").decode("utf-8") == xml
+
+def test_encode_record_formats():
+    xml = "<sportRecord>1.0,2.0;</sportRecord>"
+    assert encode_record(xml, "1") == compress_xml(xml, "1")
+    assert gzip.decompress(encode_record(xml, "1", "gzip")).decode("utf-8") == xml
+    assert encode_record(xml, "1", "raw") == xml.encode("utf-8")
+    with pytest.raises(ValueError, match="Unknown upload format"):
+        encode_record(xml, "1", "tar")
+
+def test_multipart_file_matches_urllib3():
+    data = bytes(range(256)) * 100
+    body, content_type = multipart_file("RecordFile", "r.zip", data, "application/zip")
+    boundary = content_type.split("boundary=")[1]
+    expected, expected_type = encode_multipart_formdata(
+        [("RecordFile", ("r.zip", data, "application/zip"))], boundary=boundary
+    )
+    assert content_type == expected_type
+    assert len(body) == len(expected)
+    assert b"".join(iter(lambda: body.read(1000), b"")) == expected
+    body.seek(0)
+    assert body.read() == expected